@@ -26,17 +26,41 @@
 # index of the day in the wave e.g. "1" for the 1st day, "2" for the 2nd day,
 # etc.
 #
+# Parsed quantile files are cached next to the original files with a
+# ".feather" suffix; these caches can be safely deleted.
+#
+# Values are compared against their cutoffs as 32-bit floats. Both are written
+# by R at 64-bit precision, so a value within 32-bit rounding of its cutoff
+# (about 2e-6 degrees C at 20 degrees C) can be classified differently than it
+# would be with a 64-bit comparison.
+#
 # Contact: Edgar Castro <edgar_castro@g.harvard.edu>
 
-import collections
-import csv
-import datetime
+import concurrent.futures
 import gzip
+import io
 import os
 import typing
 
+import numpy
+import pandas
+import pyarrow
+import pyarrow.compute
+import pyarrow.csv
+import pyarrow.feather
 import tqdm
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# pyarrow.csv.WriteOptions(quoting_style=...) was added in pyarrow 11
+if int(pyarrow.__version__.split(".")[0]) < 11:
+    raise Exception("ERROR: pyarrow 11 or later is required, found {}".format(
+        pyarrow.__version__
+    ))
+
 DEFAULT_TMAX_FILENAME = "mean_tmax.csv.gz"
 DEFAULT_TMIN_FILENAME = "mean_tmin.csv.gz"
 DEFAULT_TMAX_QUANTILES_FILENAME = "tmax_quantiles.csv.gz"
@@ -50,96 +74,148 @@ DEFAULT_CUTOFF_QUANTILES = [
     (15, 85)
 ]
 
+# Buffer size used when reading and writing gzipped CSV files, and the gzip
+# compression level of the (intermediate) output files
+GZIP_BUFFER_SIZE = 1 << 20
+OUTPUT_COMPRESSLEVEL = 3
 
-class ExtremeWaveDetector:
+# Number of rows formatted per write when writing output files
+OUTPUT_BATCH_SIZE = 1 << 16
 
-    def __init__(self,
-                 id_field: str,
-                 extreme_label: str,  # "hot" or "cold"
-                 output_fp: typing.TextIO,
-                 wave_id_start: int = 0):
-        """ Initialize ExtremeWaveDetector class.
+# Number of rows compared against their cutoffs at a time, which bounds the
+# temporary memory used by each filter
+FILTER_BLOCK_SIZE = 1 << 22
 
-        Args:
-            id_field: The field containing geographic identifiers.
-            extreme_label: Either "hot" or "cold".
-            output_fp: An output file pointer where CSV data will be written to.
-            wave_id_start: The ID of the first wave. If continuing from a
-                previous ExtremeWaveDetector class, this should be the wave_id
-                of the last wave.
-        """
+# Dates are represented internally as the number of days since this date
+DAYS_EPOCH = numpy.datetime64("1980-01-01", "D")
 
-        self.id_field = id_field
-        self.extreme_label = extreme_label
+# Quantiles generated by the extract_quantiles function
+QuantileTable = tuple[int, pandas.Index, numpy.ndarray]
 
-        self.last_date = datetime.datetime(1, 1, 1)
-        self.last_id = None
+# The (first_year, ids, shape) of a QuantileTable, which is shared by all
+# quantiles extracted from the same quantile file
+QuantileLayout = tuple[int, pandas.Index, tuple[int, int]]
 
-        self.date_stack = []
+# Cutoff positions generated by the index_cutoffs function, with the layout of
+# the table they point into
+CutoffIndex = tuple[numpy.ndarray, QuantileLayout]
 
-        self.wave_id = wave_id_start
+# Comparisons against the yearly cutoffs that make a day an extreme day
+EXTREME_COMPARATORS = {
+    "cold": numpy.less,
+    "hot": numpy.greater
+}
 
-        self.csv_writer = csv.DictWriter(
-            output_fp,
-            fieldnames=[self.id_field] + [
-                "year", "month", "day", "extreme", "wave_id", "wave_index",
-                "wave_length"
-            ]
-        )
-        if wave_id_start == 0:
-            self.csv_writer.writeheader()
-
-    def dump_stack(self) -> None:
-        """ Dump the stack.
-
-        Dumps all dates in the current stack to the output_fp set in the class
-        instantiation step.
-        """
-
-        self.wave_id += 1
-        for (i, date) in enumerate(self.date_stack):
-            result = {
-                self.id_field: self.last_id,
-                "year": date.year,
-                "month": date.month,
-                "day": date.day,
-                "extreme": self.extreme_label,
-                "wave_id": self.wave_id,
-                "wave_index": i + 1,
-                "wave_length": len(self.date_stack)
-            }
-            self.csv_writer.writerow(result)
-        self.date_stack = []
 
-    def push(self, line) -> None:
-        """ Push a line to the stack.
+def split_dates(dates: numpy.ndarray
+                ) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """ Split YYYYMMDD integer dates into their components.
 
-        Args:
-            line: A row of data created by stage2_combine.R.
-        """
+    Args:
+        dates: An array of dates as integers in YYYYMMDD format.
 
-        new_id = line[self.id_field]
-        new_date = datetime.datetime(
-            int(line["date"][:4]),
-            int(line["date"][4:6]),
-            int(line["date"][6:8])
-        )
+    Returns: A tuple of (year, month, day) arrays; years are int16 and months
+    and days are int8.
+    """
+
+    return (
+        (dates // 10000).astype(numpy.int16),
+        (dates // 100 % 100).astype(numpy.int8),
+        (dates % 100).astype(numpy.int8)
+    )
 
-        # If the ID changes or there is a gap of more than a day, dump the
-        # stack
-        if (
-                (new_id != self.last_id)
-                or ((new_date - self.last_date).days > 1)
-        ):
-            if len(self.date_stack) > 0:
-                self.dump_stack()
-            self.date_stack = []
 
-        # Grow the stack
-        self.date_stack.append(new_date)
+def dates_to_days(year: numpy.ndarray,
+                  month: numpy.ndarray,
+                  day: numpy.ndarray) -> numpy.ndarray:
+    """ Convert dates to serial days.
 
-        self.last_date = new_date
-        self.last_id = new_id
+    Args:
+        year: An array of years.
+        month: An array of months.
+        day: An array of days of the month.
+
+    Returns: An int32 array of the number of days since DAYS_EPOCH.
+    """
+
+    months = (
+        (year - 1970).astype("datetime64[Y]").astype("datetime64[M]")
+        + (month - 1)
+    )
+    return (
+        (months.astype("datetime64[D]") + (day - 1)) - DAYS_EPOCH
+    ).astype(numpy.int32)
+
+
+def _detect_waves_loop(ids: numpy.ndarray,
+                       days: numpy.ndarray,
+                       wave_id_start: int
+                       ) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """ Sequential version of detect_waves, compiled with Numba if available.
+    """
+
+    n = len(ids)
+    wave_id = numpy.empty(n, dtype=numpy.int64)
+    wave_index = numpy.empty(n, dtype=numpy.int32)
+    wave_length = numpy.empty(n, dtype=numpy.int32)
+
+    run_start = 0
+    for i in range(1, n + 1):
+        if i == n or ids[i] != ids[i - 1] or days[i] - days[i - 1] > 1:
+            wave_id_start += 1
+            for j in range(run_start, i):
+                wave_id[j] = wave_id_start
+                wave_index[j] = j - run_start + 1
+                wave_length[j] = i - run_start
+            run_start = i
+
+    return wave_id, wave_index, wave_length
+
+
+if numba is not None:
+    _detect_waves_loop = numba.njit(cache=True, nogil=True)(_detect_waves_loop)
+
+
+def detect_waves(ids: numpy.ndarray,
+                 days: numpy.ndarray,
+                 wave_id_start: int = 0
+                 ) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """ Detect waves in a sorted sequence of extreme days.
+
+    A new wave starts whenever the ID changes or there is a gap of more than a
+    day between consecutive extreme days.
+
+    Args:
+        ids: The geographic identifier of each extreme day, sorted by ID and
+            date.
+        days: The date of each extreme day, as a number of days since an
+            arbitrary epoch.
+        wave_id_start: The ID of the wave before the first wave. If continuing
+            from a previous call to detect_waves, this should be the wave_id
+            of the last wave.
+
+    Returns: A tuple of (wave_id, wave_index, wave_length) arrays with one
+    element per extreme day; wave_id is int64 and the others are int32.
+    """
+
+    if numba is not None:
+        return _detect_waves_loop(ids, days, wave_id_start)
+
+    new_wave = numpy.r_[
+        True,
+        (ids[1:] != ids[:-1]) | (days[1:] - days[:-1] > 1)
+    ][:len(ids)]
+    wave_starts = numpy.flatnonzero(new_wave)
+    wave_number = numpy.cumsum(new_wave) - 1
+
+    wave_id = wave_number + wave_id_start + 1
+    wave_index = (
+        numpy.arange(len(ids)) - wave_starts[wave_number] + 1
+    ).astype(numpy.int32)
+    wave_length = (
+        numpy.diff(numpy.r_[wave_starts, len(ids)]).astype(numpy.int32)
+    )[wave_number]
+    return wave_id, wave_index, wave_length
 
 
 def detect_id_column(path: str) -> str:
@@ -151,125 +227,360 @@ def detect_id_column(path: str) -> str:
     Returns: The first fieldname of the given path.
     """
 
-    with gzip.open(path, "rt") as input_fp:
-        return next(csv.reader(input_fp))[0]
+    return pyarrow.csv.open_csv(path).schema.names[0]
+
+
+def read_quantiles(input_path: str) -> pyarrow.Table:
+    """ Read a file created by stage3_temp_quantiles.R.
+
+    The parsed file is cached next to the input as a Feather file, which is
+    reused for as long as it is newer than the input.
+
+    Args:
+        input_path: The path to a file created by stage3_temp_quantiles.R
+
+    Returns: A table with the GEOID, the year, and all quantiles.
+    """
+
+    cache_path = input_path + ".feather"
+    if (
+            os.path.isfile(cache_path)
+            and os.path.getmtime(cache_path) >= os.path.getmtime(input_path)
+    ):
+        return pyarrow.feather.read_table(cache_path)
+
+    id_field = detect_id_column(input_path)
+    tqdm.tqdm.write("Reading {}".format(input_path))
+    quantiles = pyarrow.csv.read_csv(
+        input_path,
+        convert_options=pyarrow.csv.ConvertOptions(column_types={
+            id_field: pyarrow.string(),
+            "year": pyarrow.int16()
+        })
+    )
+
+    temp_path = cache_path + ".temp"
+    pyarrow.feather.write_feather(quantiles, temp_path, compression="zstd")
+    os.rename(temp_path, cache_path)
+    return quantiles
 
 
-# Return format: result[year][id]
 def extract_quantiles(input_path: str,
-                      quantile: int) -> dict[str, dict[float]]:
+                      quantile: int) -> QuantileTable:
     """ Extract quantiles from a file created by stage3_temp_quantiles.R.
 
     Args:
         input_path: The path to a file created by stage3_temp_quantiles.R
         quantile: The quantile to extract. e.g. 1st percentile -> 1
 
-    Returns: A nested dict where the first index is the year and the second
-    index is the GEOID.
+    Returns: A tuple of (first_year, ids, table) where each year's quantiles
+    are in row (year - first_year) of table and ids is a sorted index of
+    GEOIDs whose positions are the columns of table. The last row and column
+    of table are filled with -inf so that missing years and GEOIDs can be
+    looked up with an index of -1.
     """
 
-    result = collections.defaultdict(dict)
+    quantiles = read_quantiles(input_path)
+    id_field = quantiles.schema.names[0]
     quantile_field = "pctile{:02d}".format(quantile)
-    with gzip.open(input_path, "rt") as input_fp:
-        reader = csv.DictReader(input_fp)
-        id_field = reader.fieldnames[0]
-        for line in tqdm.tqdm(reader, desc="Reading {}".format(input_path)):
-            result[line["year"]][line[id_field]] = float(line[quantile_field])
-    return result
-
-
-def extract_extremes(tmax_path: str,
-                     cold_cutoffs_tmax: dict[str, dict[str, float]],
-                     tmin_path: str,
-                     hot_cutoffs_tmin: dict[str, dict[str, float]],
-                     output_path: str
+    quantiles = quantiles.select([id_field, "year", quantile_field]).to_pandas()
+
+    years = quantiles["year"].to_numpy()
+    first_year = int(years.min())
+    (id_codes, ids) = pandas.factorize(quantiles[id_field], sort=True)
+
+    # Years without quantiles keep -inf, the same as missing years
+    table = numpy.full(
+        (int(years.max()) - first_year + 2, len(ids) + 1),
+        -numpy.inf,
+        dtype=numpy.float32
+    )
+    table[years - first_year, id_codes] = quantiles[quantile_field].to_numpy()
+    return first_year, ids, table
+
+
+def read_values(input_path: str) -> pandas.DataFrame:
+    """ Read a file created by stage2_combine.R.
+
+    Args:
+        input_path: The path to a file created by stage2_combine.R.
+
+    Returns: A DataFrame with the GEOID as a categorical column with sorted
+    categories, the date as an integer in YYYYMMDD format, and the value. The
+    category codes are the GEOID codes used by all later steps, without
+    further copies.
+    """
+
+    id_field = detect_id_column(input_path)
+    tqdm.tqdm.write("> Reading {}".format(input_path))
+    values = pyarrow.csv.read_csv(
+        input_path,
+        read_options=pyarrow.csv.ReadOptions(block_size=GZIP_BUFFER_SIZE),
+        convert_options=pyarrow.csv.ConvertOptions(column_types={
+            id_field: pyarrow.dictionary(pyarrow.int32(), pyarrow.string()),
+            "date": pyarrow.int32(),
+            "value": pyarrow.float32()
+        })
+    ).to_pandas()
+
+    # Categories follow the order of first appearance; sort them so that
+    # sorting by category code also sorts by GEOID
+    values[id_field] = values[id_field].cat.reorder_categories(
+        sorted(values[id_field].cat.categories)
+    )
+
+    # Return the parsing buffers that pyarrow's allocator would otherwise keep
+    # to the operating system before the next file is read
+    pyarrow.default_memory_pool().release_unused()
+    return values
+
+
+def quantile_layout(cutoffs: QuantileTable) -> QuantileLayout:
+    """ Get the layout of a quantile table.
+
+    Args:
+        cutoffs: A quantile generated by the extract_quantiles function.
+
+    Returns: A tuple of (first_year, ids, shape) of the quantile table.
+    """
+
+    (first_year, ids, table) = cutoffs
+    return first_year, ids, table.shape
+
+
+def index_cutoffs(values: pandas.DataFrame,
+                  cutoffs: QuantileTable) -> CutoffIndex:
+    """ Locate the cutoff of each day in a flattened quantile table.
+
+    All quantiles extracted from the same quantile file share the same table
+    layout, so the result can be reused for every quantile of that file.
+
+    Args:
+        values: A file created by stage2_combine.R, read by the read_values
+            function.
+        cutoffs: Any quantile generated by the extract_quantiles function from
+            the quantile file matching values.
+
+    Returns: A tuple of (positions, layout) where positions is an int32 array
+    with the position of each day's cutoff in the flattened quantile table
+    and layout is the quantile_layout of cutoffs. Days whose year or GEOID is
+    missing from the table point to its -inf row or column.
+    """
+
+    (first_year, ids, table) = cutoffs
+    (n_rows, n_cols) = table.shape
+
+    id_field = values.columns[0]
+
+    # Years are offsets from the first year and GEOIDs are mapped once per
+    # category rather than once per row
+    year_codes = values["date"].to_numpy() // 10000 - first_year
+    year_codes[(year_codes < 0) | (year_codes >= n_rows - 1)] = n_rows - 1
+    id_codes = ids.get_indexer(values[id_field].cat.categories).astype(numpy.int32)
+    id_codes[id_codes < 0] = n_cols - 1
+
+    year_codes *= n_cols
+    year_codes += id_codes[values[id_field].cat.codes.to_numpy()]
+    return year_codes, quantile_layout(cutoffs)
+
+
+def filter_extremes(values: pandas.DataFrame,
+                    cutoffs: QuantileTable,
+                    extreme_label: str,
+                    cutoff_index: typing.Optional[CutoffIndex] = None
+                    ) -> pandas.DataFrame:
+    """ Filter extreme days from a file created by stage2_combine.R.
+
+    Days whose GEOID and year are missing from the cutoffs are never
+    considered extreme cold days and are always considered extreme heat days.
+
+    Args:
+        values: A file created by stage2_combine.R, read by the read_values
+            function.
+        cutoffs: The cutoffs to compare values against, generated by the
+            extract_quantiles function.
+        extreme_label: Either "hot" or "cold".
+        cutoff_index: The position of each day's cutoff, generated by the
+            index_cutoffs function from values and any quantile with the same
+            layout as cutoffs. Computed from cutoffs if not given.
+
+    Returns: A DataFrame with the GEOID and the year, month, and day of each
+    extreme day, sorted by GEOID and date.
+    """
+
+    if cutoff_index is None:
+        cutoff_index = index_cutoffs(values, cutoffs)
+    (cutoff_index, (first_year, ids, shape)) = cutoff_index
+    if (
+            len(cutoff_index) != len(values)
+            or first_year != cutoffs[0]
+            or shape != cutoffs[2].shape
+            or not ids.equals(cutoffs[1])
+    ):
+        raise Exception("ERROR: cutoff_index was not generated for these values and cutoffs")
+    table = cutoffs[2].ravel()
+
+    id_field = values.columns[0]
+    codes = values[id_field].cat.codes.to_numpy()
+    value = values["value"].to_numpy()
+
+    comparator = EXTREME_COMPARATORS[extreme_label]
+    is_extreme = numpy.empty(len(value), dtype=bool)
+    for start in range(0, len(value), FILTER_BLOCK_SIZE):
+        block = slice(start, start + FILTER_BLOCK_SIZE)
+        comparator(value[block], table[cutoff_index[block]], out=is_extreme[block])
+
+    codes = codes[is_extreme]
+    dates = values["date"].to_numpy()[is_extreme]
+
+    # Files created by stage2_combine.R are ordered by date, which the filter
+    # preserves, so a stable sort by GEOID alone orders days by GEOID and date
+    if numpy.all(dates[1:] >= dates[:-1]):
+        order = numpy.argsort(codes, kind="stable")
+    else:
+        order = numpy.lexsort((dates, codes))
+    codes = codes[order]
+    dates = dates[order]
+
+    (year, month, day) = split_dates(dates)
+    return pandas.DataFrame({
+        id_field: pandas.Categorical.from_codes(
+            codes,
+            categories=values[id_field].cat.categories
+        ),
+        "year": year,
+        "month": month,
+        "day": day
+    })
+
+
+def detect_extremes(values: pandas.DataFrame,
+                    cutoffs: QuantileTable,
+                    extreme_label: str,
+                    cutoff_index: typing.Optional[CutoffIndex] = None
+                    ) -> pyarrow.Table:
+    """ Detect extreme temperature days and waves in a single file.
+
+    Args:
+        values: A file created by stage2_combine.R, read by the read_values
+            function.
+        cutoffs: The cutoffs to compare values against, generated by the
+            extract_quantiles function.
+        extreme_label: Either "hot" or "cold".
+        cutoff_index: The position of each day's cutoff, generated by the
+            index_cutoffs function. Computed from cutoffs if not given.
+
+    Returns: A table of extreme days in the output format of
+    extract_extremes, with wave IDs starting from 1.
+    """
+
+    tqdm.tqdm.write("> Extracting extreme {} days".format(extreme_label))
+    extreme_days = filter_extremes(values, cutoffs, extreme_label, cutoff_index)
+    id_field = extreme_days.columns[0]
+
+    tqdm.tqdm.write("> Detecting {} waves".format(extreme_label))
+    codes = extreme_days[id_field].cat.codes.to_numpy()
+    (year, month, day) = (
+        extreme_days[column].to_numpy() for column in ["year", "month", "day"]
+    )
+    (wave_id, wave_index, wave_length) = detect_waves(
+        ids=codes,
+        days=dates_to_days(year, month, day)
+    )
+
+    return pyarrow.table({
+        id_field: pyarrow.array(extreme_days[id_field].cat.categories).take(codes),
+        "year": year,
+        "month": month,
+        "day": day,
+        "extreme": pyarrow.repeat(extreme_label, len(codes)),
+        "wave_id": wave_id,
+        "wave_index": wave_index,
+        "wave_length": wave_length
+    })
+
+
+def extract_extremes(tmax: pandas.DataFrame,
+                     cold_cutoffs_tmax: QuantileTable,
+                     tmin: pandas.DataFrame,
+                     hot_cutoffs_tmin: QuantileTable,
+                     output_path: str,
+                     max_workers: int = 2,
+                     tmax_cutoff_index: typing.Optional[CutoffIndex] = None,
+                     tmin_cutoff_index: typing.Optional[CutoffIndex] = None
                      ) -> None:
     """ Extract extreme temperature days and waves.
 
     Example:
 
         extract_extremes(
-            tmax_path="data/aggregated-combined/counties_2010/mean_tmax.csv.gz",
+            tmax=read_values("data/aggregated-combined/counties_2010/mean_tmax.csv.gz"),
             cold_cutoffs_tmax=extract_quantiles("data/extra/counties_2010/tmax_quantiles.csv.gz", 1),
-            tmin_path="data/aggregated-combined/mean_tmin.csv.gz",
+            tmin=read_values("data/aggregated-combined/mean_tmin.csv.gz"),
             hot_cutoffs_tmin=extract_quantiles("data/extra/counties_2010/tmin_quantiles.csv.gz", 99),
             output_path="data/extra/counties_2010/extreme_temps.csv.gz.csv.gz"
         )
 
     Args:
-        tmax_path: The path to a mean_tmax.csv.gz created by stage2_combine.R.
+        tmax: A mean_tmax.csv.gz created by stage2_combine.R, read by the
+            read_values function.
         cold_cutoffs_tmax: The upper bound of tmax for a day to be considered
             an extreme cold day, generated by the extract_quantiles function.
-        tmin_path: The path to a mean_tmin.csv.gz created by stage2_combine.R.
+        tmin: A mean_tmin.csv.gz created by stage2_combine.R, read by the
+            read_values function.
         hot_cutoffs_tmin: The lower bound of tmin for a day to be considered
             an extreme heat day, generated by the extract_quantiles function.
         output_path: The path that extreme temperatures should be written to.
+        max_workers: The number of threads used to detect cold and hot days
+            concurrently; 1 detects them sequentially.
+        tmax_cutoff_index: The position of each tmax day's cutoff, generated
+            by the index_cutoffs function. Computed if not given.
+        tmin_cutoff_index: The position of each tmin day's cutoff, generated
+            by the index_cutoffs function. Computed if not given.
     """
 
-    temp_path = output_path + ".temp"
-
-    with gzip.open(temp_path, "wt") as output_fp:
-        last_wave_id = None
-
-        # Detect cold waves
-        with gzip.open(tmax_path, "rt") as input_fp:
-            reader = csv.DictReader(input_fp)
-            id_field = reader.fieldnames[0]
-
-            cold_days = [
-                line
-                for line in tqdm.tqdm(reader, desc="> Extracting extreme cold days")
-                if float(line["value"]) < cold_cutoffs_tmax[line["date"][:4]].get(line[id_field], -1e100)
-            ]
-
-            tqdm.tqdm.write("> Sorting extreme cold days")
-            cold_days = sorted(
-                cold_days,
-                key=lambda line: (line[id_field], line["date"])
-            )
-
-            wave_detector = ExtremeWaveDetector(
-                id_field=id_field,
-                extreme_label="cold",
-                output_fp=output_fp,
-            )
-            for line in tqdm.tqdm(cold_days, desc="> Detecting cold waves"):
-                wave_detector.push(line)
-
-            # Dump last stack
-            wave_detector.dump_stack()
-
-            # Save last wave ID for the heat wave detector
-            last_wave_id = wave_detector.wave_id
-
-        # Detect heat waves
-        with gzip.open(tmin_path, "rt") as input_fp:
-            reader = csv.DictReader(input_fp)
-            id_field = reader.fieldnames[0]
-
-            hot_days = [
-                line
-                for line in tqdm.tqdm(reader, desc="> Extracting extreme heat days")
-                if float(line["value"]) > hot_cutoffs_tmin[line["date"][:4]].get(line[id_field], -1e100)
-            ]
-
-            tqdm.tqdm.write("> Sorting extreme heat days")
-            hot_days = sorted(
-                hot_days,
-                key=lambda line: (line[id_field], line["date"])
-            )
-
-            wave_detector = ExtremeWaveDetector(
-                id_field=id_field,
-                extreme_label="hot",
-                output_fp=output_fp,
-                wave_id_start=last_wave_id
-            )
-            for line in tqdm.tqdm(hot_days, desc="> Detecting cold waves"):
-                wave_detector.push(line)
+    passes = [
+        (tmax, cold_cutoffs_tmax, "cold", tmax_cutoff_index),
+        (tmin, hot_cutoffs_tmin, "hot", tmin_cutoff_index)
+    ]
+    if max_workers > 1:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(max_workers, len(passes))
+        ) as executor:
+            futures = [executor.submit(detect_extremes, *args) for args in passes]
+            (cold_days, hot_days) = [future.result() for future in futures]
+    else:
+        (cold_days, hot_days) = [detect_extremes(*args) for args in passes]
+
+    # Continue the hot wave IDs from the last cold wave ID; wave IDs are
+    # contiguous, so without cold days the first hot wave has ID 1 (earlier
+    # versions skipped an ID and started at 2)
+    if len(cold_days) > 0:
+        hot_days = hot_days.set_column(
+            hot_days.schema.get_field_index("wave_id"),
+            "wave_id",
+            pyarrow.compute.add(hot_days["wave_id"], cold_days["wave_id"][-1])
+        )
 
-            # Dump last stack
-            wave_detector.dump_stack()
+    temp_path = output_path + ".temp"
+    write_options = pyarrow.csv.WriteOptions(
+        include_header=False,
+        quoting_style="none"
+    )
+
+    # Written to a temporary path first so that interrupted runs are not
+    # mistaken for finished files. pyarrow writes LF line endings, which are
+    # converted to the CRLF line endings of earlier versions of this script
+    with io.BufferedWriter(
+            gzip.open(temp_path, "wb", compresslevel=OUTPUT_COMPRESSLEVEL),
+            buffer_size=GZIP_BUFFER_SIZE
+    ) as output_fp:
+        output_fp.write((",".join(cold_days.schema.names) + "\r\n").encode())
+        for extreme_days in [cold_days, hot_days]:
+            for batch in extreme_days.to_batches(max_chunksize=OUTPUT_BATCH_SIZE):
+                batch_fp = io.BytesIO()
+                pyarrow.csv.write_csv(batch, batch_fp, write_options)
+                output_fp.write(batch_fp.getvalue().replace(b"\n", b"\r\n"))
 
     os.rename(temp_path, output_path)
 
@@ -287,6 +598,11 @@ if __name__ == "__main__":
     parser.add_argument("-c", "--tmin-cutoff-quantile", default=99, type=int)
     parser.add_argument("-o", "--output", default=None)
     parser.add_argument("-a", "--autofill-args", default=None)
+    parser.add_argument(
+        "-j", "--jobs",
+        default=min(os.cpu_count() or 1, len(DEFAULT_CUTOFF_QUANTILES)),
+        type=int
+    )
     args = parser.parse_args()
 
     # Input given: convert the given file
@@ -296,11 +612,12 @@ if __name__ == "__main__":
         args.output
     ]):
         extract_extremes(
-            tmax_path=args.tmax,
+            tmax=read_values(args.tmax),
             cold_cutoffs_tmax=extract_quantiles(args.tmax_quantiles, args.tmax_cutoff_quantile),
-            tmin_path=args.tmin,
+            tmin=read_values(args.tmin),
             hot_cutoffs_tmin=extract_quantiles(args.tmin_quantiles, args.tmin_cutoff_quantile),
-            output_path=args.output
+            output_path=args.output,
+            max_workers=args.jobs
         )
 
     # No input given: determine what files need to be converted by looking for
@@ -312,6 +629,7 @@ if __name__ == "__main__":
             extra_directories = [args.autofill_args]
         else:
             extra_directories = glob.glob("output/extra/*")
+
         for extra_directory in extra_directories:
             tmax_path = os.path.join(
                 extra_directory.replace("extra", "aggregated-combined"),
@@ -333,6 +651,7 @@ if __name__ == "__main__":
                 if not os.path.isfile(path):
                     raise Exception("ERROR: {} does not exist".format(path))
 
+            output_paths = {}
             for tmax_cutoff_quantile, tmin_cutoff_quantile in DEFAULT_CUTOFF_QUANTILES:
                 output_path = os.path.join(
                     extra_directory,
@@ -344,11 +663,44 @@ if __name__ == "__main__":
                 if os.path.isfile(output_path):
                     print("Skipping {}".format(output_path))
                 else:
+                    output_paths[(tmax_cutoff_quantile, tmin_cutoff_quantile)] = output_path
+
+            if not output_paths:
+                continue
+
+            cutoffs = {
+                (tmax_cutoff_quantile, tmin_cutoff_quantile): (
+                    extract_quantiles(cold_cutoffs_tmax, tmax_cutoff_quantile),
+                    extract_quantiles(hot_cutoffs_tmin, tmin_cutoff_quantile)
+                )
+                for (tmax_cutoff_quantile, tmin_cutoff_quantile) in output_paths
+            }
+
+            # Read the tmax and tmin files and locate their cutoffs once, and
+            # reuse them for every set of cutoff quantiles, which share the
+            # same layout and only differ by the cutoffs compared against;
+            # each set is processed in its own thread, which detects cold and
+            # hot days sequentially. The files are read one after the other so
+            # that their parsing peaks do not overlap
+            tmax = read_values(tmax_path)
+            tmin = read_values(tmin_path)
+            (tmax_cutoffs, tmin_cutoffs) = next(iter(cutoffs.values()))
+            tmax_cutoff_index = index_cutoffs(tmax, tmax_cutoffs)
+            tmin_cutoff_index = index_cutoffs(tmin, tmin_cutoffs)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+                futures = []
+                for (quantiles, output_path) in output_paths.items():
                     print("Generating {}".format(output_path))
-                    extract_extremes(
-                        tmax_path=tmax_path,
-                        cold_cutoffs_tmax=extract_quantiles(cold_cutoffs_tmax, tmax_cutoff_quantile),
-                        tmin_path=tmin_path,
-                        hot_cutoffs_tmin=extract_quantiles(hot_cutoffs_tmin, tmin_cutoff_quantile),
-                        output_path=output_path
-                    )
+                    futures.append(executor.submit(
+                        extract_extremes,
+                        tmax=tmax,
+                        cold_cutoffs_tmax=cutoffs[quantiles][0],
+                        tmin=tmin,
+                        hot_cutoffs_tmin=cutoffs[quantiles][1],
+                        output_path=output_path,
+                        max_workers=1,
+                        tmax_cutoff_index=tmax_cutoff_index,
+                        tmin_cutoff_index=tmin_cutoff_index
+                    ))
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()